@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+from .models import CustomUser
+from .utils import BufferedWriter
+
+TRACKED_FIELDS = ('last_seen', 'last_login')
+
+
+def _options():
+    return settings.ACTIVITY_TRACKING
+
+
+def _write_activity(items):
+    """
+    Coalesce (user_id, field, timestamp) items and apply them with a single UPDATE ... CASE.
+    """
+    latest = {}
+    for user_id, field, timestamp in items:
+        fields = latest.setdefault(user_id, {})
+        if field not in fields or timestamp > fields[field]:
+            fields[field] = timestamp
+
+    updates = {}
+    for field in TRACKED_FIELDS:
+        whens = [When(pk=user_id, then=Value(fields[field]))
+                 for user_id, fields in latest.items() if field in fields]
+        if whens:
+            updates[field] = Case(*whens, default=F(field), output_field=DateTimeField())
+    CustomUser.objects.filter(pk__in=list(latest)).update(**updates)
+
+
+writer = BufferedWriter(_write_activity, _options)
+
+
+def touch(user, field='last_seen'):
+    """
+    Record activity of a user, writing at most once per user and field per INTERVAL.
+
+    The cache.add gate is shared by all workers, so only the first request in each
+    interval queues a write.
+    """
+    if not cache.add(f"{field}_{user.pk}", 1, _options()['INTERVAL']):
+        return
+    writer.append((user.pk, field, timezone.now()))
+
+
+def record_login(user):
+    touch(user, 'last_login')
+    touch(user, 'last_seen')
+
+
+def flush():
+    writer.flush()
@@ -1,4 +1,159 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.admin.options import get_content_type_for_model
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .circuit import CircuitOpenError
 from .models import CustomUser
-# Register your models here.
-admin.site.register(CustomUser)
+from .tasks import BROKER_ERRORS, broker_breaker, bulk_delete_users, bulk_update_users
+
+CURSOR_VAR = 'before'
+
+
+def estimated_count(queryset, limit=10000):
+    """
+    Count rows without a full scan of a large table.
+
+    Unfiltered querysets use the planner's row estimate where the database keeps one
+    (PostgreSQL, MySQL). Filtered ones are counted up to ``limit`` rows.
+    """
+    if not queryset.query.where:
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        sql = {
+            'postgresql': "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+            'mysql': "SELECT table_rows FROM information_schema.tables "
+                     "WHERE table_schema = DATABASE() AND table_name = %s",
+        }.get(connection.vendor)
+        if sql:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [table])
+                row = cursor.fetchone()
+            # reltuples is -1 until the table has been analyzed
+            if row and row[0] is not None and row[0] >= 0:
+                return row[0]
+    return queryset.order_by().values('pk')[:limit].count()
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist that pages by primary key (?before=<id>) instead of OFFSET, loads only
+    the listed columns and never runs an exact COUNT(*) of the table.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        field_names = {field.name for field in self.opts.concrete_fields}
+        columns = [name for name in self.list_display if name in field_names]
+        self.filtered_queryset = super().get_queryset(request).only(*columns)
+        cursor = self.params.get(CURSOR_VAR, '')
+        if cursor.isdigit():
+            return self.filtered_queryset.filter(pk__lt=int(cursor))
+        return self.filtered_queryset
+
+    def get_results(self, request):
+        self.paginator = self.model_admin.get_paginator(request, self.filtered_queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+
+        rows = list(self.queryset[:self.list_per_page + 1])
+        has_next = len(rows) > self.list_per_page
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = has_next or CURSOR_VAR in self.params
+        self.next_page_url = (
+            self.get_query_string({CURSOR_VAR: self.result_list[-1].pk}) if has_next else None
+        )
+        self.first_page_url = (
+            self.get_query_string(remove=[CURSOR_VAR]) if CURSOR_VAR in self.params else None
+        )
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(admin.ModelAdmin):
+    # Only these columns are loaded for the changelist; the change form loads the full row
+    list_display = ('id', 'email', 'username', 'is_active', 'is_staff', 'date_joined')
+    # CustomUser has no foreign keys to join and m2m relations are not listed
+    list_select_related = False
+    # Keyset pagination needs a stable descending pk order
+    ordering = ('-id',)
+    sortable_by = ()
+    # Case-sensitive prefix match can use the unique index on email
+    search_fields = ('email__startswith',)
+    search_help_text = "Email prefix"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    # Avoid rendering every group and permission as a select option
+    raw_id_fields = ('groups', 'user_permissions')
+    actions = ['activate_users', 'deactivate_users', 'delete_users']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # The built-in action deletes inside the request
+        actions.pop('delete_selected', None)
+        return actions
+
+    def _dispatch(self, request, queryset, task, *args, log_deletion=False):
+        chunk_size = settings.ADMIN_BULK_CHUNK_SIZE
+        rows = queryset.order_by('pk').values_list('pk', 'email')
+        chunk, jobs = [], 0
+
+        def queue(chunk):
+            broker_breaker.call(task.delay, [pk for pk, _ in chunk], *args)
+            if log_deletion:
+                self._log_deletions(request, chunk)
+
+        try:
+            for row in rows.iterator(chunk_size=chunk_size):
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    queue(chunk)
+                    chunk, jobs = [], jobs + 1
+            if chunk:
+                queue(chunk)
+                jobs += 1
+        except (CircuitOpenError, *BROKER_ERRORS):
+            self.message_user(request, f"Task queue unavailable; {jobs} jobs were queued before it failed.",
+                              messages.ERROR)
+            return
+        self.message_user(request, f"Queued {jobs} background jobs.", messages.SUCCESS)
+
+    def _log_deletions(self, request, rows):
+        # The history entries delete_selected would have written, one insert per chunk
+        content_type = get_content_type_for_model(self.model)
+        LogEntry.objects.bulk_create([
+            LogEntry(user_id=request.user.pk, content_type_id=content_type.pk, object_id=str(pk),
+                     object_repr=email[:200], action_flag=DELETION)
+            for pk, email in rows
+        ])
+
+    @admin.action(description="Activate selected users (background)", permissions=['change'])
+    def activate_users(self, request, queryset):
+        self._dispatch(request, queryset, bulk_update_users, {'is_active': True})
+
+    @admin.action(description="Deactivate selected users (background)", permissions=['change'])
+    def deactivate_users(self, request, queryset):
+        self._dispatch(request, queryset, bulk_update_users, {'is_active': False})
+
+    @admin.action(description="Delete selected users (background)", permissions=['delete'])
+    def delete_users(self, request, queryset):
+        self._dispatch(request, queryset, bulk_delete_users, log_deletion=True)
@@ -0,0 +1,132 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedUser, CustomUser
+from .perm_cache import invalidate_permissions
+
+logger = logging.getLogger(__name__)
+
+# CustomUser columns copied to ArchivedUser and back
+ARCHIVED_FIELDS = ('email', 'password', 'username', 'first_name', 'last_name',
+                   'is_active', 'date_joined', 'last_login', 'last_seen')
+
+
+def dormant_users(cutoff):
+    """
+    Non-staff users who have neither joined, logged in nor been seen since cutoff.
+    """
+    return CustomUser.objects.filter(
+        Q(last_login__isnull=True) | Q(last_login__lt=cutoff),
+        Q(last_seen__isnull=True) | Q(last_seen__lt=cutoff),
+        date_joined__lt=cutoff,
+        is_staff=False,
+        is_superuser=False,
+    )
+
+
+def _related_ids(through, field, user_ids):
+    related = defaultdict(list)
+    for user_id, related_id in through.objects.filter(customuser_id__in=user_ids).values_list('customuser_id', field):
+        related[user_id].append(related_id)
+    return related
+
+
+def _restore_related(descriptor, field, user_id, related_ids):
+    if not related_ids:
+        return
+    related_model = descriptor.field.related_model
+    existing = related_model.objects.filter(pk__in=related_ids).values_list('pk', flat=True)
+    descriptor.through.objects.bulk_create([
+        descriptor.through(customuser_id=user_id, **{field: related_id}) for related_id in existing
+    ])
+
+
+def archive_dormant_users(dormant_days=None, batch_size=None):
+    """
+    Move dormant users, with their groups and permissions, into ArchivedUser.
+
+    Each batch is copied and deleted in its own transaction, re-checking dormancy on the
+    locked rows, so the job can be interrupted and run again at any time. Users whose
+    email is already archived are logged and left in place.
+
+    :return: The number of archived users.
+    """
+    options = settings.ACCOUNT_ARCHIVAL
+    cutoff = timezone.now() - timedelta(days=dormant_days or options['DORMANT_DAYS'])
+    batch_size = batch_size or options['BATCH_SIZE']
+
+    archived = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            users = list(
+                dormant_users(cutoff).filter(id__gt=last_id).order_by('id')
+                .only('id', *ARCHIVED_FIELDS).select_for_update()[:batch_size]
+            )
+            if not users:
+                break
+            last_id = users[-1].id
+            # An archived account holding the same email would fail the whole batch
+            conflicts = set(ArchivedUser.objects.filter(email__in=[user.email for user in users])
+                            .values_list('email', flat=True))
+            if conflicts:
+                logger.warning("Not archiving users whose email is already archived: %s",
+                               sorted(user.id for user in users if user.email in conflicts))
+                users = [user for user in users if user.email not in conflicts]
+                if not users:
+                    continue
+            user_ids = [user.id for user in users]
+            groups = _related_ids(CustomUser.groups.through, 'group_id', user_ids)
+            permissions = _related_ids(CustomUser.user_permissions.through, 'permission_id', user_ids)
+            ArchivedUser.objects.bulk_create([
+                ArchivedUser(
+                    id=user.id,
+                    group_ids=groups[user.id],
+                    permission_ids=permissions[user.id],
+                    **{field: getattr(user, field) for field in ARCHIVED_FIELDS},
+                )
+                for user in users
+            ])
+            # Cascades to the API tokens and group/permission rows; verify issues a new token
+            CustomUser.objects.filter(id__in=user_ids).delete()
+        invalidate_permissions(user_ids)
+        archived += len(users)
+    return archived
+
+
+def restore_archived_user(email, password):
+    """
+    Move an archived account back into CustomUser under its original id, if password
+    is its password.
+
+    :return: The restored user, or None if no account with this email is archived or
+             the password does not match.
+    """
+    archived = ArchivedUser.objects.filter(email=email).only('password').first()
+    if archived is None or not check_password(password, archived.password):
+        return None
+    with transaction.atomic():
+        archived = ArchivedUser.objects.select_for_update().filter(email=email).first()
+        if archived is None:
+            # Restored by a concurrent login
+            return CustomUser.objects.filter(email=email).first()
+        user = CustomUser(id=archived.id, **{field: getattr(archived, field) for field in ARCHIVED_FIELDS})
+        # Counts as activity, so the next archival run does not move the account straight back
+        user.last_seen = timezone.now()
+        user.save(force_insert=True)
+        # Groups and permissions deleted while the account was archived are skipped
+        _restore_related(CustomUser.groups, 'group_id', user.id, archived.group_ids)
+        _restore_related(CustomUser.user_permissions, 'permission_id', user.id, archived.permission_ids)
+        archived.delete()
+    return user
+
+
+def is_archived(email):
+    return ArchivedUser.objects.filter(email=email).exists()
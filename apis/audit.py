@@ -0,0 +1,81 @@
+import ipaddress
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import LoginEvent
+from .utils import BufferedWriter, delete_in_batches
+
+
+def _options():
+    return settings.LOGIN_AUDIT
+
+
+def _write_events(events):
+    LoginEvent.objects.bulk_create([LoginEvent(**event) for event in events])
+
+
+writer = BufferedWriter(_write_events, _options)
+
+
+def _valid_ip(value):
+    try:
+        return str(ipaddress.ip_address(value.strip()))
+    except ValueError:
+        return None
+
+
+def client_ip(request):
+    """
+    The client address: REMOTE_ADDR, or with TRUSTED_PROXY_COUNT proxies in front of
+    the app the X-Forwarded-For entry the outermost trusted proxy added. Entries
+    further left are supplied by the client and never trusted.
+    """
+    proxies = _options()['TRUSTED_PROXY_COUNT']
+    if proxies:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        if len(forwarded) >= proxies:
+            return _valid_ip(forwarded[-proxies])
+    return _valid_ip(request.META.get('REMOTE_ADDR', ''))
+
+
+def record_event(request, event, success, user=None, email='', reason=''):
+    """
+    Queue a login audit event; it is written to the database by the buffered writer.
+
+    :param request: The request the event happened in, used for IP and user agent.
+    :param event: One of the LoginEvent event types.
+    :param success: Whether the attempt succeeded.
+    :param user: The user involved, if known.
+    :param email: The email the attempt was made for; defaults to the user's email.
+    :param reason: Short machine-readable failure reason.
+    """
+    writer.append({
+        'user_id': user.pk if user is not None else None,
+        # Unvalidated input may exceed the column; a failing row would cost its whole batch
+        'email': (email or (user.email if user is not None else ''))[:254],
+        'event': event,
+        'success': success,
+        'reason': reason,
+        'ip_address': client_ip(request),
+        'user_agent': request.META.get('HTTP_USER_AGENT', '')[:255],
+        'created_at': timezone.now(),
+    })
+
+
+def flush():
+    writer.flush()
+
+
+def prune_events(retention_days=None, batch_size=None):
+    """
+    Delete audit events older than the retention period in small batches.
+
+    :return: The number of deleted events.
+    """
+    options = _options()
+    retention_days = retention_days or options['RETENTION_DAYS']
+    batch_size = batch_size or options['PRUNE_BATCH_SIZE']
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return delete_in_batches(LoginEvent.objects.filter(created_at__lt=cutoff), batch_size)
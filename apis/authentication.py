@@ -0,0 +1,36 @@
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .tokens import InvalidToken, decode_access_token, get_token_user
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate "Authorization: Bearer <access token>" headers.
+
+    The signature is verified in-process; revocation and the user are looked up in
+    the shared cache. ``request.auth`` is set to the token claims.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            claims = decode_access_token(auth[1].decode())
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        except InvalidToken as e:
+            raise exceptions.AuthenticationFailed(str(e))
+
+        user = get_token_user(claims)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Token revoked or user inactive.')
+        return (user, claims)
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,23 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .perm_cache import get_cached_permissions, store_permissions
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that keeps each user's flattened permission set in the shared cache.
+
+    The cached set is dropped by the m2m_changed handlers in apis.signals whenever
+    the user's groups, direct permissions or their groups' permissions change.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            perms = get_cached_permissions(user_obj.pk)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                store_permissions(user_obj.pk, perms)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+def cache_is_shared(alias='default'):
+    """
+    Whether every worker process sees the same cache, which revocations, sessions
+    and circuit breaker state rely on.
+    """
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+@register(Tags.caches)
+def check_signed_tokens_cache(app_configs, **kwargs):
+    if settings.AUTH_TOKEN_FORMAT == 'signed' and not cache_is_shared():
+        return [Error(
+            "AUTH_TOKEN_FORMAT = 'signed' needs a shared cache.",
+            hint="Revoked access tokens are kept in the default cache; with a process-local "
+                 "cache a logout on one worker is not seen by the others. Point CACHES at Redis.",
+            id='apis.E001',
+        )]
+    return []
+
+
+@register(Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    if settings.SESSION_ENGINE == 'apis.sessions' and not cache_is_shared(settings.SESSION_CACHE_ALIAS):
+        return [Error(
+            "SESSION_ENGINE = 'apis.sessions' needs a shared cache.",
+            hint="Login sessions live only in the cache; with a process-local cache, verify "
+                 "on another worker never finds them. Point CACHES at Redis or use "
+                 "'django.contrib.sessions.backends.cached_db'.",
+            id='apis.E002',
+        )]
+    return []
@@ -0,0 +1,117 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import CACHE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state lives in the shared cache, so every worker sees it trip.
+
+    Closed: calls go through; failures are counted over FAILURE_WINDOW seconds.
+    Open: after FAILURE_THRESHOLD failures, calls fail with CircuitOpenError for
+    RECOVERY_TIMEOUT seconds without touching the remote service.
+    Half-open: afterwards one caller at a time probes the service; success closes
+    the circuit, failure opens it again.
+
+    If the cache itself is unreachable the state is unknown and the circuit counts
+    as open, so callers fail fast instead of erroring.
+
+    :param name: Key into settings.CIRCUIT_BREAKERS and prefix of the cache keys.
+    :param failure_exceptions: Exceptions that count as a failure of the service.
+    """
+
+    def __init__(self, name, failure_exceptions=(Exception,)):
+        self.name = name
+        self.failure_exceptions = failure_exceptions
+        self._failures_key = f"circuit_{name}_failures"
+        self._open_key = f"circuit_{name}_open"
+        self._tripped_key = f"circuit_{name}_tripped"
+        self._probe_key = f"circuit_{name}_probe"
+
+    @property
+    def options(self):
+        return settings.CIRCUIT_BREAKERS[self.name]
+
+    def state(self):
+        try:
+            found = cache.get_many([self._open_key, self._tripped_key])
+        except CACHE_ERRORS:
+            logger.warning("%s circuit state unavailable, treating it as open", self.name, exc_info=True)
+            return OPEN
+        if self._open_key in found:
+            return OPEN
+        if self._tripped_key in found:
+            return HALF_OPEN
+        return CLOSED
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func through the breaker.
+
+        :raises CircuitOpenError: If the circuit is open or another caller is probing.
+        """
+        state = self.state()
+        if state == OPEN:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        if state == HALF_OPEN and not self._claim_probe():
+            raise CircuitOpenError(f"{self.name} circuit is being probed")
+
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self._record_failure(state)
+            raise
+        if state == HALF_OPEN:
+            self.reset()
+            logger.info("%s circuit closed", self.name)
+        return result
+
+    def reset(self):
+        try:
+            cache.delete_many([self._failures_key, self._open_key, self._tripped_key, self._probe_key])
+        except CACHE_ERRORS:
+            logger.warning("Could not reset %s circuit", self.name, exc_info=True)
+
+    def _claim_probe(self):
+        try:
+            return cache.add(self._probe_key, 1, self.options['RECOVERY_TIMEOUT'])
+        except CACHE_ERRORS:
+            logger.warning("%s circuit state unavailable, treating it as open", self.name, exc_info=True)
+            return False
+
+    def _record_failure(self, state):
+        try:
+            self._count_failure(state)
+        except CACHE_ERRORS:
+            logger.warning("Could not record %s circuit failure", self.name, exc_info=True)
+
+    def _count_failure(self, state):
+        options = self.options
+        if state == CLOSED:
+            cache.add(self._failures_key, 0, options['FAILURE_WINDOW'])
+            try:
+                failures = cache.incr(self._failures_key)
+            except ValueError:
+                # The window expired between add and incr
+                failures = 1
+                cache.set(self._failures_key, failures, options['FAILURE_WINDOW'])
+            if failures < options['FAILURE_THRESHOLD']:
+                return
+        # The tripped marker outlives the open period and makes the next caller probe
+        cache.set(self._tripped_key, 1, None)
+        cache.set(self._open_key, 1, options['RECOVERY_TIMEOUT'])
+        cache.delete(self._probe_key)
+        logger.warning("%s circuit opened", self.name)
@@ -0,0 +1,111 @@
+import hashlib
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+def idempotent(view):
+    """
+    Mark a view as honouring the Idempotency-Key header (see IdempotencyMiddleware).
+
+    Apply it as the outermost decorator so the marker is on the final view function.
+    """
+    view.idempotent = True
+    return view
+
+
+def _options():
+    return settings.IDEMPOTENCY
+
+
+def _fingerprint(request):
+    # Same key with a different body or session is a different request
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for header, value in stored['headers']:
+        response[header] = value
+    response.cookies = stored['cookies']
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+class IdempotencyMiddleware:
+    """
+    Serve retried POSTs to @idempotent views from the first response for their key.
+
+    The first request for an Idempotency-Key takes a short lock, runs the view and
+    stores its response (below 500) in the shared cache for IDEMPOTENCY['TTL'].
+    Duplicates arriving while it runs wait up to WAIT_TIMEOUT for that response
+    instead of running the view in parallel. Must sit above SessionMiddleware so the
+    stored response includes the session cookie set by login.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        pending = getattr(request, '_idempotency', None)
+        if pending is None:
+            return response
+        result_key, lock_key, lock_token, fingerprint = pending
+        try:
+            if response.status_code < 500 and not response.streaming:
+                cache.set(result_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'content': response.content,
+                    'headers': [(k, v) for k, v in response.items() if k.lower() != 'set-cookie'],
+                    'cookies': response.cookies,
+                }, _options()['TTL'])
+        finally:
+            # Past LOCK_TIMEOUT the lock may belong to another request; only release our own.
+            # The cache has no compare-and-delete, which leaves a window of one round trip.
+            if cache.get(lock_key) == lock_token:
+                cache.delete(lock_key)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key or not getattr(view_func, 'idempotent', False) or request.method != 'POST':
+            return None
+        if len(key) > 255:
+            return _error('Idempotency-Key must be at most 255 characters.', 400)
+
+        options = _options()
+        hashed_key = hashlib.sha256(key.encode()).hexdigest()
+        result_key = f"idempotency_{hashed_key}"
+        lock_key = f"idempotency_lock_{hashed_key}"
+        fingerprint = _fingerprint(request)
+        lock_token = secrets.token_hex(16)
+
+        deadline = time.monotonic() + options['WAIT_TIMEOUT']
+        while True:
+            stored = cache.get(result_key)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return _error('Idempotency-Key was already used for a different request.', 422)
+                return _replay(stored)
+            if cache.add(lock_key, lock_token, options['LOCK_TIMEOUT']):
+                request._idempotency = (result_key, lock_key, lock_token, fingerprint)
+                return None
+            if time.monotonic() >= deadline:
+                return _error('A request with this Idempotency-Key is still in progress.', 409)
+            time.sleep(options['POLL_INTERVAL'])
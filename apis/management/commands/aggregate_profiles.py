@@ -0,0 +1,45 @@
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apis.profiling import ENDPOINT_SEPARATOR, PROFILE_SUFFIX
+
+
+class Command(BaseCommand):
+    help = ("Merge the request profiles of each endpoint into one collapsed-stack file, "
+            "ready for flamegraph.pl or speedscope.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory (default: REQUEST_PROFILING['DIR'])")
+        parser.add_argument('--output-dir', help="Where to write <endpoint>.folded (default: <dir>/aggregated)")
+        parser.add_argument('--endpoint', help="Only aggregate this endpoint (view name)")
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.REQUEST_PROFILING['DIR'])
+        if not directory.is_dir():
+            raise CommandError(f"No profile directory at {directory}")
+        output_dir = Path(options['output_dir'] or directory / 'aggregated')
+
+        stacks = defaultdict(Counter)
+        profiles = Counter()
+        for path in directory.glob(f'*{PROFILE_SUFFIX}'):
+            endpoint = path.name.split(ENDPOINT_SEPARATOR, 1)[0]
+            if options['endpoint'] and endpoint != options['endpoint']:
+                continue
+            profiles[endpoint] += 1
+            for line in path.read_text().splitlines():
+                stack, _, count = line.rpartition(' ')
+                if stack and count.isdigit():
+                    stacks[endpoint][stack] += int(count)
+
+        if not stacks:
+            self.stdout.write("No profiles found.")
+            return
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for endpoint, counts in sorted(stacks.items()):
+            lines = ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+            (output_dir / f"{endpoint}{PROFILE_SUFFIX}").write_text(lines)
+            self.stdout.write(f"{endpoint}: {profiles[endpoint]} profiles, {sum(counts.values())} samples")
+        self.stdout.write(self.style.SUCCESS(f"Wrote flame graph input to {output_dir}"))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apis.archive import archive_dormant_users
+
+
+class Command(BaseCommand):
+    help = "Move accounts dormant for longer than ACCOUNT_ARCHIVAL['DORMANT_DAYS'] into the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACCOUNT_ARCHIVAL['DORMANT_DAYS'])
+        parser.add_argument('--batch-size', type=int, default=settings.ACCOUNT_ARCHIVAL['BATCH_SIZE'])
+
+    def handle(self, *args, **options):
+        archived = archive_dormant_users(dormant_days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} dormant users."))
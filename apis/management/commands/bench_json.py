@@ -0,0 +1,63 @@
+import io
+import timeit
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from apis.parsers import FastJSONParser
+from apis.renderers import FastJSONRenderer, orjson
+from apis.serializers import (FastUserLoginSerializer, FastVerifyOTPSerializer,
+                              UserLoginSerializer, VerifyOTPSerializer)
+
+PROFILE = {'username': 'testuser', 'email': 'testuser@example.com'}
+HISTORY = {
+    'results': [
+        {'id': 1000 - i, 'event': 'login', 'success': True, 'reason': '',
+         'ip_address': '203.0.113.7', 'user_agent': 'okhttp/4.9.3',
+         'created_at': '2024-01-01T12:00:00.123456Z'}
+        for i in range(20)
+    ],
+    'next': 980,
+}
+LOGIN_BODY = b'{"email": "testuser@example.com", "password": "correct horse battery"}'
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark JSON rendering, parsing and request validation per request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed; the fast classes fall back to json."))
+
+        default_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        default_parser, fast_parser = JSONParser(), FastJSONParser()
+        cases = [
+            ('render profile',
+             lambda: default_renderer.render(PROFILE), lambda: fast_renderer.render(PROFILE)),
+            ('render login history',
+             lambda: default_renderer.render(HISTORY), lambda: fast_renderer.render(HISTORY)),
+            ('parse login body',
+             lambda: default_parser.parse(io.BytesIO(LOGIN_BODY)),
+             lambda: fast_parser.parse(io.BytesIO(LOGIN_BODY))),
+            ('validate login',
+             lambda: UserLoginSerializer(data={'email': 'a@example.com', 'password': 'x'}).is_valid(),
+             lambda: FastUserLoginSerializer({'email': 'a@example.com', 'password': 'x'}).is_valid()),
+            ('validate otp',
+             lambda: VerifyOTPSerializer(data={'otp': '123456'}).is_valid(),
+             lambda: FastVerifyOTPSerializer({'otp': '123456'}).is_valid()),
+        ]
+        self.stdout.write(f"{'case':<22}{'default us':>12}{'fast us':>10}{'saved':>8}")
+        for name, default, fast in cases:
+            default_us = self.measure(default, number)
+            fast_us = self.measure(fast, number)
+            saved = 1 - fast_us / default_us
+            self.stdout.write(f"{name:<22}{default_us:>12.2f}{fast_us:>10.2f}{saved:>8.0%}")
+
+    def measure(self, func, number):
+        # Best of three runs, in microseconds per call
+        return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
@@ -0,0 +1,69 @@
+import secrets
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+ENGINES = [
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'apis.sessions',
+]
+# What user_login stores in the session
+LOGIN_STATE = {'generated_test_otp': '123456', 'user_id': 1}
+
+
+class Command(BaseCommand):
+    help = "Measure session write and read latency per engine as the django_session table grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='0,10000,100000',
+                            help="Comma-separated django_session row counts to measure at")
+        parser.add_argument('--ops', type=int, default=200,
+                            help="Sessions per measurement; keep below the cache's MAX_ENTRIES")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.stdout.write(f"{'engine':<45}{'rows':>8}{'write us':>10}{'read us':>10}")
+        # Filler rows are created inside a transaction that is rolled back afterwards
+        with transaction.atomic():
+            rows = 0
+            for size in sizes:
+                self.fill(size - rows)
+                rows = size
+                for engine in ENGINES:
+                    write_us, read_us = self.measure(import_module(engine).SessionStore, options['ops'])
+                    self.stdout.write(f"{engine:<45}{rows:>8}{write_us:>10.1f}{read_us:>10.1f}")
+            transaction.set_rollback(True)
+        cache.clear()
+
+    def fill(self, count):
+        expire_date = timezone.now() + timedelta(days=14)
+        for start in range(0, count, 5000):
+            Session.objects.bulk_create([
+                Session(session_key=secrets.token_hex(16), session_data='', expire_date=expire_date)
+                for _ in range(min(5000, count - start))
+            ])
+
+    def measure(self, store_class, ops):
+        # Start each engine with an empty cache so earlier runs cannot evict its entries
+        cache.clear()
+        keys = []
+        start = time.perf_counter()
+        for _ in range(ops):
+            session = store_class()
+            session.update(LOGIN_STATE)
+            session.save()
+            keys.append(session.session_key)
+        write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in keys:
+            store_class(key).load()
+        read = time.perf_counter() - start
+        return write / ops * 1e6, read / ops * 1e6
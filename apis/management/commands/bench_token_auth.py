@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apis.models import CustomUser
+from apis.tokens import issue_access_token
+
+
+class Command(BaseCommand):
+    help = "Compare user_profile throughput with DB tokens and signed access tokens."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            # Everything is created inside a transaction that is rolled back afterwards
+            with transaction.atomic(), override_settings(
+                ACTIVITY_TRACKING={**settings.ACTIVITY_TRACKING, 'BACKGROUND': False},
+            ):
+                user = CustomUser.objects.create_user(email='bench-token@example.com', password='bench')
+                headers = {
+                    'db token': f'Token {Token.objects.create(user=user).key}',
+                    'signed token': f'Bearer {issue_access_token(user)}',
+                }
+                for name, header in headers.items():
+                    self.run_case(name, header, options['requests'])
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+    def run_case(self, name, header, requests):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=header)
+        url = reverse('profile')
+        client.get(url)  # warm up caches
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = client.get(url)
+                assert response.status_code == 200, response.content
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{name:>12}: {requests / elapsed:8.0f} req/s  "
+            f"{elapsed / requests * 1e6:7.0f} us/req  "
+            f"{len(queries) / requests:.2f} queries/req"
+        )
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from apis.models import CustomUser
+from apis.perm_cache import build_permission_sets, permission_cache_key
+
+
+class Command(BaseCommand):
+    help = "Resolve and cache the permission sets of all active users in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = CustomUser.objects.filter(is_active=True).only('id', 'is_active', 'is_superuser')
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(users.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            perms = build_permission_sets(batch)
+            cache.set_many(
+                {permission_cache_key(user_id): user_perms for user_id, user_perms in perms.items()},
+                settings.PERMISSION_CACHE_TIMEOUT,
+            )
+            last_id = batch[-1].id
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Warmed permission cache for {total} users."))
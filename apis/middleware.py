@@ -0,0 +1,25 @@
+from django.utils.functional import SimpleLazyObject, empty
+
+from .activity import touch
+
+
+class LastSeenMiddleware:
+    """
+    Track the last time each authenticated user made a request.
+
+    Only users that were already resolved during the request are tracked, so an
+    unauthenticated or session-less request never costs an extra user query.
+    DRF views set the authenticated user on the underlying HttpRequest.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return response
+        if user is not None and user.is_authenticated:
+            touch(user)
+        return response
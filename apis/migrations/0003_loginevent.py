@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0002_alter_customuser_managers_alter_customuser_groups_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('event', models.CharField(choices=[('login', 'Login'), ('verify_otp', 'OTP verification'), ('logout', 'Logout')], max_length=20)),
+                ('success', models.BooleanField()),
+                ('reason', models.CharField(blank=True, max_length=50)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='login_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-id'], name='loginevent_user_id_desc')],
+            },
+        ),
+    ]
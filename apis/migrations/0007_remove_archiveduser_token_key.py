@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0006_archiveduser'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='archiveduser',
+            name='token_key',
+        ),
+    ]
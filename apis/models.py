@@ -1,6 +1,9 @@
 # Create your models here.
 from django.contrib.auth.models import AbstractUser, BaseUserManager, Group, Permission
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -26,6 +29,7 @@ class CustomUserManager(BaseUserManager):
 class CustomUser(AbstractUser):
     username = models.CharField(max_length=20)
     email = models.EmailField(unique=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
     # Add any additional fields you need
     groups = models.ManyToManyField(Group, related_name='custom_users')
     user_permissions = models.ManyToManyField(Permission, related_name='custom_users')
@@ -35,8 +39,77 @@ class CustomUser(AbstractUser):
 
     objects = CustomUserManager()
 
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # Used by the admin forms; archived accounts keep their email reserved
+        if (not exclude or 'email' not in exclude) and ArchivedUser.objects.filter(email=self.email).exists():
+            raise ValidationError({'email': self.unique_error_message(CustomUser, ('email',))})
 
 
+class LoginEvent(models.Model):
+    LOGIN = 'login'
+    VERIFY_OTP = 'verify_otp'
+    LOGOUT = 'logout'
+    EVENT_CHOICES = [
+        (LOGIN, 'Login'),
+        (VERIFY_OTP, 'OTP verification'),
+        (LOGOUT, 'Logout'),
+    ]
 
+    # No FK constraint, so history outlives the account and bulk inserts skip the check
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                             on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name='login_events')
+    email = models.EmailField(blank=True)
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    success = models.BooleanField()
+    reason = models.CharField(max_length=50, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
-    
+    class Meta:
+        indexes = [
+            # Serves the keyset-paginated history: WHERE user_id = ? AND id < ? ORDER BY id DESC
+            models.Index(fields=['user', '-id'], name='loginevent_user_id_desc'),
+        ]
+
+    def __str__(self):
+        outcome = 'success' if self.success else 'failure'
+        return f"{self.event} {outcome} for {self.email}"
+
+
+class RefreshToken(models.Model):
+    # Only the SHA-256 digest of the token is stored
+    key = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='refresh_tokens')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Refresh token of {self.user_id}"
+
+
+class ArchivedUser(models.Model):
+    """
+    A dormant account moved out of CustomUser by apis.archive; restored on its next login.
+    """
+    # The original CustomUser id, given back on restore so login history still matches
+    id = models.BigIntegerField(primary_key=True)
+    # Unique like CustomUser.email: an email stays reserved while it is in either table
+    email = models.EmailField(unique=True)
+    password = models.CharField(max_length=128)
+    username = models.CharField(max_length=20, blank=True)
+    first_name = models.CharField(max_length=150, blank=True)
+    last_name = models.CharField(max_length=150, blank=True)
+    is_active = models.BooleanField(default=True)
+    date_joined = models.DateTimeField()
+    last_login = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    group_ids = models.JSONField(default=list)
+    permission_ids = models.JSONField(default=list)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Archived {self.email}"
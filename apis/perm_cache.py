@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+
+from .models import CustomUser
+
+
+def permission_cache_key(user_id):
+    return f"perms_{user_id}"
+
+
+def get_cached_permissions(user_id):
+    """
+    Return the cached permission set of a user, or None if it is not cached.
+    """
+    return cache.get(permission_cache_key(user_id))
+
+
+def store_permissions(user_id, perms):
+    cache.set(permission_cache_key(user_id), perms, settings.PERMISSION_CACHE_TIMEOUT)
+
+
+def invalidate_permissions(user_ids):
+    """
+    Drop the cached permission sets of the given users.
+    """
+    keys = [permission_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_group_members(group_ids):
+    """
+    Drop the cached permission sets of every member of the given groups.
+    """
+    user_ids = CustomUser.groups.through.objects.filter(
+        group_id__in=group_ids
+    ).values_list('customuser_id', flat=True).distinct()
+    invalidate_permissions(list(user_ids))
+
+
+def build_permission_sets(users):
+    """
+    Compute the flattened permission sets of many users with a fixed number of queries.
+
+    :param users: Users to resolve; only id, is_active and is_superuser are read.
+    :return: A dict mapping user id to a set of "app_label.codename" strings.
+    """
+    perms = {user.id: set() for user in users if user.is_active}
+    if not perms:
+        return perms
+
+    superusers = [user.id for user in users if user.is_active and user.is_superuser]
+    if superusers:
+        all_perms = {
+            f"{ct}.{name}"
+            for ct, name in Permission.objects.values_list('content_type__app_label', 'codename')
+        }
+        for user_id in superusers:
+            perms[user_id] = set(all_perms)
+
+    user_ids = [user_id for user_id in perms if user_id not in superusers]
+    direct = CustomUser.user_permissions.through.objects.filter(
+        customuser_id__in=user_ids
+    ).values_list('customuser_id', 'permission__content_type__app_label', 'permission__codename')
+    via_groups = CustomUser.groups.through.objects.filter(
+        customuser_id__in=user_ids, group__permissions__isnull=False
+    ).values_list(
+        'customuser_id',
+        'group__permissions__content_type__app_label',
+        'group__permissions__codename',
+    )
+    for rows in (direct, via_groups):
+        for user_id, ct, name in rows:
+            perms[user_id].add(f"{ct}.{name}")
+    return perms
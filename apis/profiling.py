@@ -0,0 +1,174 @@
+import functools
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = '.folded'
+# Profile file names are "<endpoint>__<details>.folded"
+ENDPOINT_SEPARATOR = '__'
+
+
+def _options():
+    return settings.REQUEST_PROFILING
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename):
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix):
+            return filename[len(prefix):].lstrip(os.sep)
+    return filename
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """
+    Return the stack ending at frame in collapsed format: root;...;leaf.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Statistical profiler: a daemon thread that periodically records the current
+    stack of every registered thread with sys._current_frames().
+    """
+
+    def __init__(self):
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._active.set()
+
+    def stop(self, thread_id):
+        with self._lock:
+            stacks = self._stacks.pop(thread_id, Counter())
+            if not self._stacks:
+                self._active.clear()
+        return stacks
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(_options()['INTERVAL'])
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+            del frames
+
+
+sampler = StackSampler()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match else 'unresolved'
+    return re.sub(r'[^A-Za-z0-9_.-]', '-', name)
+
+
+_writes = itertools.count(1)
+
+
+def _profile_time(path):
+    # The write time in ns, from "<endpoint>__<time_ns>-<pid>-<ms>ms.folded"
+    try:
+        return int(path.name.rsplit(ENDPOINT_SEPARATOR, 1)[1].split('-', 1)[0])
+    except (IndexError, ValueError):
+        return 0
+
+
+def rotate_profiles(directory, max_files):
+    """
+    Delete the oldest profiles beyond max_files. Ages come from the file names, so
+    files removed concurrently by another worker are simply skipped.
+    """
+    profiles = sorted(directory.glob(f'*{PROFILE_SUFFIX}'), key=_profile_time)
+    for path in profiles[:max(len(profiles) - max_files, 0)]:
+        path.unlink(missing_ok=True)
+
+
+def write_profile(endpoint, stacks, elapsed_ms):
+    """
+    Write collapsed stacks to the profile directory. Every MAX_FILES / 10 writes the
+    process also drops the oldest profiles beyond MAX_FILES, so the directory is not
+    scanned on every write.
+    """
+    options = _options()
+    directory = Path(options['DIR'])
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{endpoint}{ENDPOINT_SEPARATOR}{time.time_ns()}-{os.getpid()}-{elapsed_ms:.0f}ms{PROFILE_SUFFIX}"
+    (directory / name).write_text(''.join(f"{stack} {count}\n" for stack, count in stacks.items()))
+
+    if next(_writes) % max(options['MAX_FILES'] // 10, 1) == 0:
+        rotate_profiles(directory, options['MAX_FILES'])
+
+
+class SamplingProfilerMiddleware:
+    """
+    Profile a SAMPLE_RATE fraction of requests, plus any request slower than
+    SLOW_THRESHOLD_MS, with the stack sampler.
+
+    Catching slow requests means sampling every request while the threshold is set;
+    the cost is one stack walk per INTERVAL on a background thread. Only profiles of
+    sampled or slow requests are written.
+    """
+
+    def __init__(self, get_response):
+        if not _options()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = _options()
+        sampled = random.random() < options['SAMPLE_RATE']
+        threshold = options['SLOW_THRESHOLD_MS']
+        if not sampled and threshold is None:
+            return self.get_response(request)
+
+        thread_id = threading.get_ident()
+        sampler.start(thread_id)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop(thread_id)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        if stacks and (sampled or elapsed_ms >= threshold):
+            try:
+                write_profile(endpoint_name(request), stacks, elapsed_ms)
+            except OSError:
+                # A full disk or a racing rotation must not fail the request
+                logger.exception("Could not write request profile")
+        return response
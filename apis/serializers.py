@@ -1,6 +1,9 @@
+from collections.abc import Mapping
 
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from rest_framework import serializers
-from .models import CustomUser
+from .models import ArchivedUser, CustomUser, LoginEvent
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -9,6 +12,12 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         model = CustomUser
         fields = ['username', 'email', 'password']
 
+    def validate_email(self, value):
+        # Archived accounts keep their email reserved until they are restored
+        if ArchivedUser.objects.filter(email=value).exists():
+            raise serializers.ValidationError("custom user with this email already exists.")
+        return value
+
 
 class UserLoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -17,3 +26,78 @@ class UserLoginSerializer(serializers.Serializer):
 
 class VerifyOTPSerializer(serializers.Serializer):
     otp = serializers.CharField()
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
+def _clean_char(value):
+    # Same coercion and messages as serializers.CharField with its defaults
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValidationError('Not a valid string.')
+    value = str(value).strip()
+    if not value:
+        raise ValidationError('This field may not be blank.')
+    return value
+
+
+def _clean_email(value):
+    value = _clean_char(value)
+    validate_email(value)
+    return value
+
+
+class LightweightSerializer:
+    """
+    Request validator for hot endpoints with the is_valid / validated_data / errors
+    interface of serializers.Serializer, but plain functions instead of DRF fields.
+
+    Subclasses map field names to cleaning functions in ``fields``; a cleaning
+    function returns the cleaned value or raises django ValidationError. Error
+    output matches the equivalent DRF serializer.
+    """
+    fields = {}
+
+    def __init__(self, data):
+        self.initial_data = data
+        self.validated_data = {}
+        self.errors = {}
+
+    def is_valid(self):
+        if not isinstance(self.initial_data, Mapping):
+            self.errors = {'non_field_errors': [
+                f'Invalid data. Expected a dictionary, but got {type(self.initial_data).__name__}.'
+            ]}
+            return False
+        for name, clean in self.fields.items():
+            if name not in self.initial_data:
+                self.errors[name] = ['This field is required.']
+                continue
+            value = self.initial_data[name]
+            if value is None:
+                self.errors[name] = ['This field may not be null.']
+                continue
+            try:
+                self.validated_data[name] = clean(value)
+            except ValidationError as e:
+                self.errors[name] = e.messages
+        if self.errors:
+            self.validated_data = {}
+        return not self.errors
+
+
+class FastUserLoginSerializer(LightweightSerializer):
+    """Lightweight equivalent of UserLoginSerializer."""
+    fields = {'email': _clean_email, 'password': _clean_char}
+
+
+class FastVerifyOTPSerializer(LightweightSerializer):
+    """Lightweight equivalent of VerifyOTPSerializer."""
+    fields = {'otp': _clean_char}
+
+
+class LoginEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LoginEvent
+        fields = ['id', 'event', 'success', 'reason', 'ip_address', 'user_agent', 'created_at']
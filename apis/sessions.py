@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStore(CachedDBStore):
+    """
+    Cache-first session engine that writes through to the database only when needed.
+
+    Sessions holding nothing but SESSION_EPHEMERAL_KEYS (the OTP login state, which
+    is useless once the cached OTP has expired anyway) live in the cache only. Any
+    other session, e.g. an admin login, is written through exactly like cached_db.
+    Reads always try the cache first.
+    """
+    cache_key_prefix = 'apis.sessions'
+
+    def is_ephemeral(self):
+        return set(self._get_session()) <= settings.SESSION_EPHEMERAL_KEYS
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if not self.is_ephemeral():
+            try:
+                return super().save(must_create)
+            except UpdateError:
+                # The session only lived in the cache so far
+                return super().save(must_create=True)
+
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import CustomUser
+from .perm_cache import invalidate_group_members, invalidate_permissions, permission_cache_key
+from .tokens import user_cache_key
+
+
+def _reverse_field(instance):
+    return 'group_id' if isinstance(instance, Group) else 'permission_id'
+
+
+def _forget_instance_perms(instance):
+    for attr in ('_perm_cache', '_user_perm_cache', '_group_perm_cache'):
+        instance.__dict__.pop(attr, None)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate cached permissions when a user's groups or direct permissions change.
+
+    Forward changes (user.groups.add(...)) affect the instance only; reverse changes
+    (group.custom_users.add(...)) affect the users in pk_set, or every related user
+    on clear, which is collected before the rows are removed.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _forget_instance_perms(instance)
+            invalidate_permissions([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._perm_clear_ids = list(
+            sender.objects.filter(**{_reverse_field(instance): instance.pk})
+            .values_list('customuser_id', flat=True)
+        )
+    elif action == 'post_clear':
+        invalidate_permissions(instance.__dict__.pop('_perm_clear_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_permissions(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate cached permissions of group members when a group's permissions change.
+    """
+    if action not in ('pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # Invalidating on both sides of a clear keeps readers from re-caching stale sets.
+        invalidate_group_members([instance.pk])
+    elif action == 'pre_clear':
+        instance._perm_clear_ids = list(
+            sender.objects.filter(permission_id=instance.pk).values_list('group_id', flat=True)
+        )
+    elif action == 'post_clear':
+        invalidate_group_members(instance.__dict__.pop('_perm_clear_ids', []))
+    else:
+        invalidate_group_members(pk_set)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_group_members([instance.pk])
+
+
+@receiver(post_save, sender=Permission)
+@receiver(pre_delete, sender=Permission)
+def permission_changed(sender, instance, **kwargs):
+    """
+    Invalidate superusers, whose cached sets hold every permission, and on delete
+    every user holding the permission directly or through a group.
+    """
+    user_ids = set(CustomUser.objects.filter(is_superuser=True).values_list('id', flat=True))
+    if kwargs.get('created') is None:
+        user_ids.update(
+            CustomUser.user_permissions.through.objects.filter(permission_id=instance.pk)
+            .values_list('customuser_id', flat=True)
+        )
+        invalidate_group_members(
+            Group.permissions.through.objects.filter(permission_id=instance.pk).values_list('group_id', flat=True)
+        )
+    invalidate_permissions(user_ids)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    # Drop the copy used by signed token authentication and the cached permission
+    # set, which depends on is_active and is_superuser, in one round trip
+    cache.delete_many([user_cache_key(instance.pk), permission_cache_key(instance.pk)])
@@ -3,9 +3,37 @@ from django.core.mail import send_mail
 from django.utils import timezone
 import random
 from datetime import timedelta
-from config import settings
+from django.conf import settings
 from django.core.cache import cache
+from kombu.exceptions import OperationalError
+import json
+import logging
+import os
+import smtplib
 import time
+import uuid
+from pathlib import Path
+from .archive import archive_dormant_users
+from .audit import prune_events
+from .perm_cache import invalidate_permissions
+from .tokens import forget_users
+from .circuit import CircuitBreaker, CircuitOpenError
+from .models import CustomUser
+from .utils import delete_in_batches
+from django.contrib.sessions.models import Session
+
+logger = logging.getLogger(__name__)
+
+SMTP_ERRORS = (smtplib.SMTPException, OSError)
+BROKER_ERRORS = (OperationalError, OSError)
+
+smtp_breaker = CircuitBreaker('smtp', failure_exceptions=SMTP_ERRORS)
+broker_breaker = CircuitBreaker('broker', failure_exceptions=BROKER_ERRORS)
+
+
+class EmailUnavailable(Exception):
+    pass
+
 
 @shared_task
 def generate_otp():
@@ -19,9 +47,132 @@ def generate_and_store_otp(email):
     return otp
 
 def send_otp_email(email, otp):
+    """
+    Send the OTP email through the SMTP circuit breaker.
+
+    When SMTP fails or the circuit is open, the message goes to the local spool
+    (OTP_EMAIL_FALLBACK = 'spool') or EmailUnavailable is raised ('fail').
+
+    :return: True if the email was sent, False if it was spooled.
+    """
     subject = 'Your OTP for Login'
     message = f'Your OTP for login is: {otp}. This OTP is valid for 2 minutes.  '
     from_email = settings.EMAIL_HOST_USER
     recipient_list = [email]
-    send_mail(subject, message, from_email, recipient_list)
+    try:
+        smtp_breaker.call(send_mail, subject, message, from_email, recipient_list)
+    except (CircuitOpenError, *SMTP_ERRORS) as e:
+        if settings.OTP_EMAIL_FALLBACK != 'spool':
+            raise EmailUnavailable(str(e)) from e
+        logger.warning("Spooling OTP email: %s", e)
+        # Useless once the OTP has expired, so the drainer discards it after that
+        spool_email(subject, message, from_email, recipient_list,
+                    expires_at=time.time() + settings.OTP_LIFETIME)
+        return False
+    return True
+
+
+@shared_task
+def send_otp_email_task(email, otp):
+    send_otp_email(email, otp)
+
+
+def dispatch_otp_email(email, otp):
+    """
+    Queue the OTP email on Celery when OTP_EMAIL_ASYNC is set, otherwise send it now.
+
+    A slow or unreachable broker trips the broker circuit and the email is sent inline.
+
+    :return: False if the email was spooled for later delivery, True otherwise.
+    """
+    if settings.OTP_EMAIL_ASYNC:
+        try:
+            broker_breaker.call(send_otp_email_task.apply_async, (email, otp), retry=False)
+            return True
+        except (CircuitOpenError, *BROKER_ERRORS) as e:
+            logger.warning("Broker unavailable, sending OTP email inline: %s", e)
+    return send_otp_email(email, otp)
+
+
+def spool_email(subject, message, from_email, recipient_list, expires_at=None):
+    spool_dir = Path(settings.EMAIL_SPOOL_DIR)
+    spool_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    name = f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+    tmp_path = spool_dir / f".{name}"
+    # Spooled emails may hold OTPs: readable by the owner only
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as spool_file:
+        json.dump({
+            'subject': subject,
+            'message': message,
+            'from_email': from_email,
+            'recipient_list': recipient_list,
+            'expires_at': expires_at,
+        }, spool_file)
+    # Atomic rename so the drainer never reads a partial file
+    os.replace(tmp_path, spool_dir / name)
+
 
+@shared_task
+def drain_email_spool():
+    """
+    Send spooled emails oldest first; stops as soon as SMTP is still failing.
+    Emails past their expires_at (expired OTPs) are deleted unsent.
+
+    :return: The number of emails sent.
+    """
+    spool_dir = Path(settings.EMAIL_SPOOL_DIR)
+    if not spool_dir.is_dir():
+        return 0
+    sent = 0
+    for path in sorted(spool_dir.glob('[!.]*.json')):
+        # Claim the file by renaming it so concurrent drainers never send it twice
+        claimed = path.with_suffix('.sending')
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        email = json.loads(claimed.read_text())
+        if email.get('expires_at') and email['expires_at'] < time.time():
+            claimed.unlink()
+            continue
+        try:
+            smtp_breaker.call(send_mail, email['subject'], email['message'],
+                              email['from_email'], email['recipient_list'])
+        except (CircuitOpenError, *SMTP_ERRORS):
+            os.rename(claimed, path)
+            break
+        claimed.unlink()
+        sent += 1
+    return sent
+
+
+@shared_task
+def bulk_update_users(user_ids, values):
+    # queryset.update() skips post_save, so drop cached copies of the users explicitly
+    updated = CustomUser.objects.filter(pk__in=user_ids).update(**values)
+    forget_users(user_ids)
+    invalidate_permissions(user_ids)
+    return updated
+
+
+@shared_task
+def bulk_delete_users(user_ids):
+    return CustomUser.objects.filter(pk__in=user_ids).delete()[0]
+
+
+@shared_task
+def prune_login_events():
+    return prune_events()
+
+
+@shared_task
+def clear_expired_sessions(batch_size=None):
+    # expire_date is indexed, so each batch is an index range scan
+    expired = Session.objects.filter(expire_date__lt=timezone.now())
+    return delete_in_batches(expired, batch_size or settings.SESSION_CLEANUP_BATCH_SIZE)
+
+
+@shared_task
+def archive_dormant_accounts():
+    return archive_dormant_users()
@@ -0,0 +1,132 @@
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import CustomUser, RefreshToken
+
+ACCESS_TOKEN_SALT = 'apis.tokens.access'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _options():
+    return settings.SIGNED_TOKENS
+
+
+def _revoked_key(jti):
+    return f"revoked_{jti}"
+
+
+def user_cache_key(user_id):
+    return f"user_{user_id}"
+
+
+def _hash(raw):
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def issue_access_token(user):
+    """
+    Return an HMAC-signed access token carrying the user id, a token id and its expiry.
+    """
+    claims = {
+        'uid': user.pk,
+        'jti': secrets.token_hex(8),
+        'exp': int(time.time()) + _options()['ACCESS_LIFETIME'],
+    }
+    return signing.dumps(claims, salt=ACCESS_TOKEN_SALT)
+
+
+def decode_access_token(token):
+    """
+    Verify the signature and expiry of an access token and return its claims.
+
+    :raises InvalidToken: If the token is malformed, tampered with or expired.
+    """
+    try:
+        claims = signing.loads(token, salt=ACCESS_TOKEN_SALT)
+    except signing.BadSignature:
+        raise InvalidToken('Invalid token.')
+    if claims['exp'] < time.time():
+        raise InvalidToken('Token has expired.')
+    return claims
+
+
+def revoke_access_token(claims):
+    """
+    Add an access token to the revocation set until it would have expired anyway.
+    """
+    remaining = int(claims['exp'] - time.time()) + 1
+    if remaining > 0:
+        cache.set(_revoked_key(claims['jti']), 1, remaining)
+
+
+def get_token_user(claims):
+    """
+    Return the active user for verified claims, or None if revoked or gone.
+
+    The revocation check and user lookup share one cache round trip; the database
+    is only hit when the user is not cached.
+    """
+    revoked_key, user_key = _revoked_key(claims['jti']), user_cache_key(claims['uid'])
+    found = cache.get_many([revoked_key, user_key])
+    if revoked_key in found:
+        return None
+    user = found.get(user_key)
+    if user is None:
+        user = CustomUser.objects.filter(pk=claims['uid'], is_active=True).first()
+        if user is None:
+            return None
+        cache.set(user_key, user, _options()['USER_CACHE_TIMEOUT'])
+    return user
+
+
+def forget_users(user_ids):
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+def issue_refresh_token(user):
+    raw = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        key=_hash(raw),
+        user=user,
+        expires_at=timezone.now() + timedelta(seconds=_options()['REFRESH_LIFETIME']),
+    )
+    return raw
+
+
+def issue_token_pair(user):
+    return {
+        'access': issue_access_token(user),
+        'refresh': issue_refresh_token(user),
+        'token_type': 'Bearer',
+        'expires_in': _options()['ACCESS_LIFETIME'],
+    }
+
+
+def rotate_refresh_token(raw):
+    """
+    Exchange a refresh token for a new token pair; the old refresh token is consumed.
+
+    :raises InvalidToken: If the refresh token is unknown or expired.
+    """
+    key = _hash(raw)
+    token = RefreshToken.objects.select_related('user').filter(key=key).first()
+    if token is None:
+        raise InvalidToken('Invalid refresh token.')
+    # Only the request whose DELETE removed the row may use it; a concurrent
+    # refresh with the same token deletes nothing
+    deleted, _ = RefreshToken.objects.filter(key=key).delete()
+    if not deleted:
+        raise InvalidToken('Invalid refresh token.')
+    if token.expires_at < timezone.now() or not token.user.is_active:
+        raise InvalidToken('Refresh token has expired.')
+    return issue_token_pair(token.user)
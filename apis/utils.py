@@ -0,0 +1,127 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import close_old_connections
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:  # pragma: no cover - only needed with the Redis cache
+    RedisError = OSError
+
+logger = logging.getLogger(__name__)
+
+# What a cache backend raises when its server is down or slow
+CACHE_ERRORS = (RedisError, OSError)
+
+
+class BufferedWriter:
+    """
+    Collect items in an in-process ring buffer and write them out in batches.
+
+    Items are handed to ``write`` once ``FLUSH_SIZE`` of them are pending or
+    ``FLUSH_INTERVAL`` seconds have passed. With ``BACKGROUND`` enabled the writes
+    happen on a daemon thread, otherwise inline in the caller that crosses a threshold.
+    When more than ``MAX_BUFFER`` items are pending the oldest ones are dropped; a
+    batch that fails to write is retried item by item.
+
+    :param write: Callable receiving a list of at most FLUSH_SIZE items.
+    :param get_options: Callable returning a dict with MAX_BUFFER, FLUSH_SIZE,
+                        FLUSH_INTERVAL and BACKGROUND; read on every call so
+                        settings overrides take effect.
+    """
+
+    def __init__(self, write, get_options):
+        self._write = write
+        self._get_options = get_options
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_flush = time.monotonic()
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, item):
+        options = self._get_options()
+        with self._lock:
+            self._buffer.append(item)
+            while len(self._buffer) > options['MAX_BUFFER']:
+                self._buffer.popleft()
+                self.dropped += 1
+            pending = len(self._buffer)
+        due = (
+            pending >= options['FLUSH_SIZE']
+            or time.monotonic() - self._last_flush >= options['FLUSH_INTERVAL']
+        )
+        if options['BACKGROUND']:
+            self._ensure_thread()
+            if due:
+                self._wakeup.set()
+        elif due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every pending item now, in batches of FLUSH_SIZE.
+        """
+        with self._lock:
+            items = list(self._buffer)
+            self._buffer.clear()
+            self._last_flush = time.monotonic()
+        if not items:
+            return
+        batch_size = self._get_options()['FLUSH_SIZE']
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            try:
+                self._write(batch)
+            except Exception:
+                if len(batch) == 1:
+                    logger.exception("Failed to write a buffered item")
+                    continue
+                # Retry one by one so a single bad item only loses itself
+                logger.warning("Failed to write %d buffered items, retrying one by one", len(batch),
+                               exc_info=True)
+                for item in batch:
+                    try:
+                        self._write([item])
+                    except Exception:
+                        logger.exception("Failed to write a buffered item")
+
+    def _ensure_thread(self):
+        # The thread does not survive a fork, so a dead or missing one is restarted.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='buffered-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._get_options()['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+def delete_in_batches(queryset, batch_size):
+    """
+    Delete the rows of queryset in batches of primary keys so no single statement
+    holds locks on a large part of the table.
+
+    :return: The number of deleted rows.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += model._base_manager.filter(pk__in=pks).delete()[0]
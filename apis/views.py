@@ -3,24 +3,46 @@ from django.shortcuts import render
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from .serializers import UserRegistrationSerializer, UserLoginSerializer, VerifyOTPSerializer
+from .serializers import (UserRegistrationSerializer, UserLoginSerializer, VerifyOTPSerializer,
+                          LoginEventSerializer, RefreshTokenSerializer,
+                          FastUserLoginSerializer, FastVerifyOTPSerializer)
 
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
 from django.contrib.auth.hashers import make_password
-from .models import CustomUser
-from .tasks import send_otp_email, generate_and_store_otp
+from .models import CustomUser, LoginEvent
+from .idempotency import idempotent
+from .tasks import dispatch_otp_email, generate_and_store_otp, EmailUnavailable
+from .audit import record_event
+from .activity import record_login
+from .archive import is_archived, restore_archived_user
+from .authentication import SignedTokenAuthentication
+from .utils import CACHE_ERRORS
+from .tokens import InvalidToken, issue_token_pair, revoke_access_token, rotate_refresh_token
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+import logging
 import time
 from django.core.cache import cache
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 
+logger = logging.getLogger(__name__)
+
+# DRF Token keys ("Token <key>") and signed access tokens ("Bearer <token>")
+API_AUTHENTICATION_CLASSES = [TokenAuthentication, SignedTokenAuthentication]
+
+IDEMPOTENCY_KEY_PARAMETER = openapi.Parameter(
+    'Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+    description="Optional unique key; retries with the same key replay the first response",
+)
 
 # REGISTER
+@idempotent
 @swagger_auto_schema(
     method='post',
     request_body=UserRegistrationSerializer,
@@ -38,6 +60,7 @@ from drf_yasg import openapi
                           "   a new user account will be created and the user details will be returned.\n"
                           "5. If the email is already registered, an error response will be returned.\n"
                           "6. Check the response status code and message to determine the outcome.",
+    manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
 )
 @api_view(['POST'])
 def register_user(request):
@@ -56,12 +79,18 @@ def register_user(request):
             # Hash the password with Argon2 using make_password
             hashed_password = make_password(serializer.validated_data['password'])
             
-            # Check if the email is already registered
+            # The serializer rejects emails of live users; archived accounts keep theirs
+            # reserved too. Checking after the insert also catches an account archived
+            # concurrently, whose row blocks the insert until the archival commits.
             email = serializer.validated_data['email']
-            if CustomUser.objects.filter(email=email).exists():
+            try:
+                with transaction.atomic():
+                    user = serializer.save(password=hashed_password)
+                    if is_archived(email):
+                        raise IntegrityError("Email belongs to an archived account")
+            except IntegrityError:
+                # Taken by a concurrent registration or an archived account
                 return Response({'error': 'Email already registered'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            user = serializer.save(password=hashed_password)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -69,14 +98,17 @@ def register_user(request):
 
 
 # LOGIN
+@idempotent
 @swagger_auto_schema(
     method='post',
     request_body=UserLoginSerializer,
     responses={
         status.HTTP_200_OK: "Successfully logged in",
+        status.HTTP_202_ACCEPTED: "OTP email delayed",
         status.HTTP_401_UNAUTHORIZED: "Unauthorized",
         status.HTTP_404_NOT_FOUND: "User not found",
         status.HTTP_400_BAD_REQUEST: "Bad Request",
+        status.HTTP_503_SERVICE_UNAVAILABLE: "Email or cache service unavailable",
     },
     operation_summary="**User Login**",
     operation_description="**Log in a user by providing their email and password.**\n"
@@ -87,8 +119,8 @@ def register_user(request):
                           "   If the provided credentials are valid, an OTP will be generated and sent to your registered email address.\n"
                           "   Additionally, the OTP will be displayed in the terminal for testing purposes.\n"
                           "5. Proceed to the 'Verify OTP' API endpoint and complete the request body by entering the OTP you received in your email(or printed in the terminal).\n"
-                          "   **Please note that the OTP is valid for a duration of 2 minutes.**"
-                          
+                          "   **Please note that the OTP is valid for a duration of 2 minutes.**",
+    manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
 )
 @api_view(['POST'])
 def user_login(request):
@@ -100,35 +132,57 @@ def user_login(request):
     :param request: The request object.
     :return: A Response containing success message or error response.
     """
-    serializer = UserLoginSerializer(data=request.data)
+    serializer = FastUserLoginSerializer(data=request.data)
     if serializer.is_valid():
         email = serializer.validated_data['email']
         password = serializer.validated_data['password']
         
         user = CustomUser.objects.filter(email=email).first()
+        # Archived accounts come back only with their password, which restoring has
+        # already checked; otherwise they look like an unknown email
+        restored = False
+        if user is None:
+            user = restore_archived_user(email, password)
+            restored = user is not None
         if user:
-            if user.check_password(password):
+            if restored or user.check_password(password):
                 # Generate and send OTP
 
                 # this is for test which will be printed in the terminal,
                 # you can work even without config. celery
-                generated_test_otp = generate_and_store_otp(user.email) 
+                try:
+                    generated_test_otp = generate_and_store_otp(user.email)
+                except CACHE_ERRORS:
+                    # Without the cache the OTP cannot be verified later
+                    logger.exception("Could not store OTP")
+                    record_event(request, LoginEvent.LOGIN, False, user=user, reason='cache_unavailable')
+                    return Response({'error': 'Login is temporarily unavailable. Please try again later.'},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
                 print('This is otp for test:', generated_test_otp)
 
-                # this one is for celery
-
-                send_otp_email(user.email, generated_test_otp)
-                
-                
+                # this one is for celery; fails fast when SMTP or the broker is down
+                try:
+                    delivered = dispatch_otp_email(user.email, generated_test_otp)
+                except EmailUnavailable:
+                    record_event(request, LoginEvent.LOGIN, False, user=user, reason='email_unavailable')
+                    return Response({'error': 'Email service unavailable. Please try again later.'},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
                 # Store the values in the session for later validation
                 request.session['generated_test_otp'] = generated_test_otp
                 request.session['user_id'] = user.id
-                
+
+                record_event(request, LoginEvent.LOGIN, True, user=user)
+                if not delivered:
+                    # Spooled until SMTP recovers; it is dropped if the OTP expires first
+                    return Response({'message': 'OTP email delayed. If it does not arrive, log in again.'},
+                                    status=status.HTTP_202_ACCEPTED)
                 return Response({'message': 'OTP sent successfully'}, status=status.HTTP_200_OK)
             else:
+                record_event(request, LoginEvent.LOGIN, False, user=user, reason='invalid_password')
                 return Response({'error': 'Invalid password'}, status=status.HTTP_401_UNAUTHORIZED)
         else:
+            record_event(request, LoginEvent.LOGIN, False, email=email, reason='user_not_found')
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -136,6 +190,7 @@ def user_login(request):
 
 
 # Verify OTP 
+@idempotent
 @swagger_auto_schema(
     method='post',
     request_body=VerifyOTPSerializer,
@@ -153,6 +208,7 @@ def user_login(request):
                           3. Click the 'Execute' button to retrieve the response.
                           4. If the OTP is valid, an authentication token will be issued.
                           5. Use the issued token in the 'Authorization' header for subsequent requests.""",
+    manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
 )
 @api_view(['POST'])
 def verify_otp(request):
@@ -164,7 +220,7 @@ def verify_otp(request):
     :param request: The request object.
     :return: A Response containing success message or error response.
     """
-    serializer = VerifyOTPSerializer(data=request.data)
+    serializer = FastVerifyOTPSerializer(data=request.data)
     if serializer.is_valid():
         input_otp = serializer.validated_data['otp']
         user_id = request.session.get('user_id')
@@ -172,12 +228,14 @@ def verify_otp(request):
         try:
             user = CustomUser.objects.get(id=user_id)
         except ObjectDoesNotExist:
+            record_event(request, LoginEvent.VERIFY_OTP, False, reason='user_not_found')
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
         # Get the cached OTP and timestamp
         cache_key = f"otp_{user.email}"  # Use the user's email as the cache key
         cached_data = cache.get(cache_key)
         if cached_data is None:
+            record_event(request, LoginEvent.VERIFY_OTP, False, user=user, reason='otp_missing')
             return Response({'error': 'OTP expired or not generated'}, status=status.HTTP_400_BAD_REQUEST)
         
         print(cached_data)
@@ -188,23 +246,64 @@ def verify_otp(request):
         if input_otp == cached_otp:
             # Check if OTP has expired
             current_timestamp = int(time.time())
-            expiration_time = 60  # OTP expires in 2 minutes (120 seconds)
-            if current_timestamp - cached_timestamp <= expiration_time:
+            if current_timestamp - cached_timestamp <= settings.OTP_LIFETIME:
                 # OTP is valid and within the expiration time
-                token, _ = Token.objects.get_or_create(user=user)
-
                 # Remove the OTP data from the cache to prevent reusing
                 cache.delete(cache_key)
 
+                record_event(request, LoginEvent.VERIFY_OTP, True, user=user)
+                record_login(user)
+                if settings.AUTH_TOKEN_FORMAT == 'signed':
+                    return Response(issue_token_pair(user), status=status.HTTP_200_OK)
+
+                token, _ = Token.objects.get_or_create(user=user)
                 return Response({'token': token.key}, status=status.HTTP_200_OK)
             else:
+                record_event(request, LoginEvent.VERIFY_OTP, False, user=user, reason='otp_expired')
                 return Response({'error': 'OTP expired'}, status=status.HTTP_400_BAD_REQUEST)
         else:
+            record_event(request, LoginEvent.VERIFY_OTP, False, user=user, reason='invalid_otp')
             return Response({'error': 'Invalid OTP'}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# REFRESH TOKEN
+@swagger_auto_schema(
+    method='post',
+    request_body=RefreshTokenSerializer,
+    responses={
+        status.HTTP_200_OK: "New access and refresh tokens issued",
+        status.HTTP_400_BAD_REQUEST: "Bad Request",
+        status.HTTP_401_UNAUTHORIZED: "Invalid or expired refresh token",
+    },
+    operation_summary="**Refresh Access Token**",
+    operation_description="""**Exchange a refresh token for a new access token (only when signed tokens are enabled).**
+    1.Click the 'Try it out' button.
+    2.Fill out the request body with the refresh token returned by 'Verify OTP' or a previous refresh.
+    3. Click the 'Execute' button to retrieve the response.
+    4. The refresh token can be used once; keep the new one from the response.""",
+)
+@api_view(['POST'])
+def refresh_token(request):
+    """
+    Refresh Access Token.
+
+    Exchange a server-side refresh token for a new signed access token and refresh token.
+
+    :param request: The request object.
+    :return: A Response containing the new token pair or an error response.
+    """
+    serializer = RefreshTokenSerializer(data=request.data)
+    if serializer.is_valid():
+        try:
+            tokens = rotate_refresh_token(serializer.validated_data['refresh'])
+        except InvalidToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(tokens, status=status.HTTP_200_OK)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 #PROFILE
 @swagger_auto_schema(
     method='get',
@@ -223,7 +322,7 @@ def verify_otp(request):
     ]
 )
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes(API_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def user_profile(request):
     """
@@ -267,7 +366,7 @@ def user_profile(request):
     ]
 )
 @api_view(['PATCH'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes(API_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def update_profile(request):
     """
@@ -310,7 +409,7 @@ def update_profile(request):
     ]
 )
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes(API_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def user_logout(request):
     """
@@ -323,8 +422,14 @@ def user_logout(request):
     """
     if request.method == 'POST':
         try:
-            # Delete the user's token to logout
-            request.user.auth_token.delete()
+            if isinstance(request.auth, Token):
+                # Delete the user's token to logout
+                request.user.auth_token.delete()
+            else:
+                # Signed access token: revoke it and drop the refresh tokens
+                revoke_access_token(request.auth)
+                request.user.refresh_tokens.all().delete()
+            record_event(request, LoginEvent.LOGOUT, True, user=request.user)
             return Response({'message': 'Successfully logged out.'}, status=status.HTTP_200_OK)
         except Token.DoesNotExist:
             return Response({'error': 'Token not found. Already logged out.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -350,7 +455,7 @@ def user_logout(request):
     ]
 )
 @api_view(['DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes(API_AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 def delete_user(request):
     """
@@ -363,7 +468,61 @@ def delete_user(request):
     """
     user = request.user
     try:
+        if not isinstance(request.auth, Token):
+            revoke_access_token(request.auth)
         user.delete()
         return Response({'message': 'User deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
     except Exception as e:
         return Response({'error': 'An error occurred while deleting the user.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# LOGIN HISTORY
+@swagger_auto_schema(
+    method='get',
+    responses={
+        status.HTTP_200_OK: LoginEventSerializer(many=True),
+        status.HTTP_400_BAD_REQUEST: "Invalid cursor or limit",
+        status.HTTP_401_UNAUTHORIZED: "Unauthorized",
+    },
+    operation_summary="**Login History**",
+    operation_description="""**List the authenticated user's login, OTP verification and logout events, newest first.**
+    1.Click the 'Try it out' button.
+    2.Enter the authentication token you obtained after verifying the OTP into the 'Authorization' field.
+    3. Optionally set 'limit' (at most 100) and pass the 'next' value of a previous response as 'cursor' to get the following page.
+    4. Click the 'Execute' button to retrieve the response.""",
+    manual_parameters=[
+        openapi.Parameter('Authorization', openapi.IN_HEADER, description="Token", type=openapi.TYPE_STRING),
+        openapi.Parameter('cursor', openapi.IN_QUERY, description="Return events older than this id", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('limit', openapi.IN_QUERY, description="Page size", type=openapi.TYPE_INTEGER),
+    ]
+)
+@api_view(['GET'])
+@authentication_classes(API_AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated])
+def login_history(request):
+    """
+    Login History.
+
+    Return a keyset-paginated page of the authenticated user's audit events.
+
+    :param request: The request object.
+    :return: A Response with the events and the cursor of the next page, or an error response.
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+        cursor = request.query_params.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return Response({'error': 'cursor and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1:
+        return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+    events = LoginEvent.objects.filter(user=request.user).order_by('-id')
+    if cursor is not None:
+        events = events.filter(id__lt=cursor)
+    page = list(events.values(*LoginEventSerializer.Meta.fields)[:limit + 1])
+    next_cursor = page[limit - 1]['id'] if len(page) > limit else None
+    return Response({
+        'results': LoginEventSerializer(page[:limit], many=True).data,
+        'next': next_cursor,
+    }, status=status.HTTP_200_OK)
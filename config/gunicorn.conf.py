@@ -0,0 +1,20 @@
+"""
+Gunicorn settings: gunicorn -c config/gunicorn.conf.py config.wsgi
+
+The app is imported once in the master and preloaded (see config/preload.py), so
+workers share its memory copy-on-write and serve their first request warm.
+"""
+
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_PRELOAD', '1')
+
+preload_app = True
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+
+def post_fork(server, worker):
+    # Never reuse a database connection opened by the master
+    from django.db import connections
+    connections.close_all()
@@ -10,11 +10,15 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# True while running `manage.py test`
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -48,11 +52,14 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'apis.profiling.SamplingProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'apis.idempotency.IdempotencyMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apis.middleware.LastSeenMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -140,13 +147,40 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # AUTH TOKEN 
 AUTH_USER_MODEL = 'apis.CustomUser'
 
+AUTHENTICATION_BACKENDS = [
+    'apis.backends.CachedModelBackend',
+]
+
+# How long a user's resolved permission set stays in the cache (seconds)
+PERMISSION_CACHE_TIMEOUT = 60 * 15
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
+        'apis.authentication.SignedTokenAuthentication',
+    ],
+    # orjson-backed JSON when installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'apis.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'apis.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     # Other settings...
 }
 
+# Token issued by verify_otp: 'db' for a DRF Token, 'signed' for a short-lived
+# signed access token (verified without a DB query) plus a server-side refresh token
+AUTH_TOKEN_FORMAT = 'db'
+SIGNED_TOKENS = {
+    'ACCESS_LIFETIME': 60 * 5,
+    'REFRESH_LIFETIME': 60 * 60 * 24 * 14,
+    'USER_CACHE_TIMEOUT': 60 * 5,
+}
+
 #--------------------------
 
 #  configuration for celery
@@ -156,6 +190,33 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_IMPORTS = ("apis.tasks",)
+CELERY_BEAT_SCHEDULE = {
+    'prune-login-events': {
+        'task': 'apis.tasks.prune_login_events',
+        'schedule': 60 * 60,
+    },
+    'clear-expired-sessions': {
+        'task': 'apis.tasks.clear_expired_sessions',
+        'schedule': 60 * 60,
+    },
+    'archive-dormant-accounts': {
+        'task': 'apis.tasks.archive_dormant_accounts',
+        'schedule': 60 * 60 * 24,
+    },
+    # Run beat and a worker on each web host so its local spool gets drained
+    'drain-email-spool': {
+        'task': 'apis.tasks.drain_email_spool',
+        'schedule': 60,
+    },
+}
+# Fail fast instead of blocking requests when Redis is slow or down
+CELERY_BROKER_CONNECTION_TIMEOUT = 2
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'socket_connect_timeout': 2,
+    'socket_timeout': 2,
+    'max_retries': 0,
+}
+CELERY_TASK_PUBLISH_RETRY = False
 
 # configuration for sending emails
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -164,18 +225,116 @@ EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = "your email"
 EMAIL_HOST_PASSWORD = "app password"
+# Seconds allowed for connecting to and talking to the SMTP server
+EMAIL_TIMEOUT = 5
+
+# Seconds an OTP stays valid after login
+OTP_LIFETIME = 60
+
+# Queue OTP emails on Celery instead of sending them inside the login request
+OTP_EMAIL_ASYNC = False
+# When SMTP is down: 'spool' writes the email to EMAIL_SPOOL_DIR for the
+# drain_email_spool task and login answers 202 (the email is dropped if the OTP
+# expires first), 'fail' makes login answer 503 right away
+OTP_EMAIL_FALLBACK = 'spool'
+EMAIL_SPOOL_DIR = BASE_DIR / 'email_spool'
+
+# Shared-state circuit breakers around outbound SMTP and broker calls
+CIRCUIT_BREAKERS = {
+    'smtp': {'FAILURE_THRESHOLD': 3, 'FAILURE_WINDOW': 60, 'RECOVERY_TIMEOUT': 30},
+    'broker': {'FAILURE_THRESHOLD': 3, 'FAILURE_WINDOW': 60, 'RECOVERY_TIMEOUT': 15},
+}
 
 # To get your Gmail app password: https://support.google.com/accounts/answer/185833
 #---------------------------------
 
 # settings for cache stroring
+# Shared by every worker: token revocations, sessions, OTPs, circuit breakers and
+# idempotency keys live here. Run Redis with maxmemory-policy noeviction so
+# revocations are never evicted before they expire. This is the same Redis server
+# as the Celery broker, so a broker outage is also a cache outage and takes the API
+# down with it; use a separate Redis server for the cache where that matters.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        # Fail fast like the broker instead of blocking for the OS TCP timeout
+        'OPTIONS': {
+            'socket_connect_timeout': 2,
+            'socket_timeout': 2,
+        },
     }
 }
 
 CACHE_MIDDLEWARE_SECONDS = 600  # Set to 10 minutes
+
+# Sessions are read from the cache; only sessions holding keys other than
+# SESSION_EPHEMERAL_KEYS are written through to the database, so the cache must
+# be shared by all workers (system check apis.E002)
+SESSION_ENGINE = 'apis.sessions'
+SESSION_EPHEMERAL_KEYS = {'generated_test_otp', 'user_id'}
+SESSION_CLEANUP_BATCH_SIZE = 1000
 #--------------------------------------------------------
 
+# login audit log: events are buffered in memory and written in batches
+LOGIN_AUDIT = {
+    'MAX_BUFFER': 10000,      # oldest events are dropped beyond this many pending
+    'FLUSH_SIZE': 100,        # events per bulk insert
+    'FLUSH_INTERVAL': 5,      # seconds between background flushes
+    'BACKGROUND': True,       # flush from a daemon thread instead of the request
+    'RETENTION_DAYS': 90,
+    'PRUNE_BATCH_SIZE': 1000,
+    # Reverse proxies in front of the app that append to X-Forwarded-For; with 0 the
+    # header is ignored and REMOTE_ADDR is logged
+    'TRUSTED_PROXY_COUNT': 0,
+}
+
+# last_login / last_seen tracking: coalesced in memory, flushed as one UPDATE per batch
+ACTIVITY_TRACKING = {
+    'INTERVAL': 300,          # at most one write per user and field in this many seconds
+    'MAX_BUFFER': 10000,
+    'FLUSH_SIZE': 500,        # users per UPDATE ... CASE statement
+    'FLUSH_INTERVAL': 10,
+    'BACKGROUND': True,
+}
+
+# Opt-in sampling profiler; aggregate with `manage.py aggregate_profiles`
+REQUEST_PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,          # fraction of requests profiled regardless of latency
+    'SLOW_THRESHOLD_MS': 500,     # also keep profiles of slower requests; None to disable
+    'INTERVAL': 0.005,            # seconds between stack samples
+    'DIR': BASE_DIR / 'profiles',
+    'MAX_FILES': 1000,            # oldest profiles are deleted beyond this
+}
+
+# Non-staff accounts without a login or request for DORMANT_DAYS are moved to
+# ArchivedUser and restored on their next login
+ACCOUNT_ARCHIVAL = {
+    'DORMANT_DAYS': 365,
+    'BATCH_SIZE': 500,        # users copied and deleted per transaction
+}
+
+# Users per background job queued by the admin bulk actions
+ADMIN_BULK_CHUNK_SIZE = 1000
+
+# Idempotency-Key handling for register, login and verify (seconds)
+IDEMPOTENCY = {
+    'TTL': 60 * 60 * 24,      # how long a response can be replayed
+    'LOCK_TIMEOUT': 30,       # upper bound on how long the first request may hold its key
+    'WAIT_TIMEOUT': 5,        # how long a concurrent duplicate waits for the first response
+    'POLL_INTERVAL': 0.05,
+}
+
+if TESTING:
+    # Write buffered rows inline so tests see them inside their own transaction
+    LOGIN_AUDIT.update(BACKGROUND=False, FLUSH_SIZE=1)
+    ACTIVITY_TRACKING.update(BACKGROUND=False, FLUSH_SIZE=1)
+    # Tests run without Redis, in a single process
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    SILENCED_SYSTEM_CHECKS = ['apis.E002']
+    # Hashing with the production hasher dominates test run time
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+TEST_RUNNER = 'config.test_runner.ParallelDiscoverRunner'
+#--------------------------------------------------------
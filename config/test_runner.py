@@ -0,0 +1,15 @@
+from django.test.runner import DiscoverRunner
+
+
+class ParallelDiscoverRunner(DiscoverRunner):
+    """
+    DiscoverRunner that runs tests in one process per CPU core unless --parallel is given.
+
+    Set DJANGO_TEST_PROCESSES to cap the number of processes, or pass --parallel=1
+    to run serially (e.g. to use --pdb).
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(parallel='auto')
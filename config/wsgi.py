@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# DJANGO_PRELOAD=1: warm the app and freeze its heap before the server forks workers
+from config import preload  # noqa: E402
+
+if preload.enabled():
+    preload.preload()